@@ -2,16 +2,36 @@
 """
 Crypto Treasury Companies Data Updater
 - Stocks: yfinance
-- Crypto: CoinGecko (free, no API key)
+- Crypto: CoinGecko (free; set COINGECKO_API_KEY to use a demo key)
 """
 
+import asyncio
+import contextlib
+import functools
+import hashlib
+import inspect
+import itertools
 import json
+import logging
 import os
-from datetime import datetime, timedelta
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+import numpy as np
 import yfinance as yf
 import requests
+from requests.adapters import HTTPAdapter
 import time
 
+try:
+    import orjson
+except ImportError:  # optional; falls back to the stdlib json module
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
 # Treasury Companies by Crypto
 TREASURY_COMPANIES = {
     "BTC": {
@@ -116,140 +136,576 @@ STOCK_COLORS = [
 ]
 
 
-def get_stock_data(ticker: str, days: int = 400) -> list:
+def loads_json(raw: bytes):
+    """Parse UTF-8 JSON bytes (orjson when available)"""
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+
+def read_json(path: str):
+    """Load a JSON file"""
+    with open(path, "rb") as f:
+        return loads_json(f.read())
+
+
+def dumps_json(data) -> bytes:
+    """Serialize data to UTF-8 JSON bytes (orjson when available)"""
+    if orjson:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+@contextlib.contextmanager
+def atomic_open(path: str):
+    """Open a temp file for binary writing that replaces path on success.
+    
+    Readers (the frontend, a concurrent cache lookup) see either the old
+    file or the complete new one, never a partial write.
+    """
+    tmp = f"{path}.{threading.get_ident()}.tmp"  # cache entries are written from threads
+    try:
+        with open(tmp, "wb") as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
+def write_json(path: str, data) -> None:
+    """Write data as UTF-8 JSON"""
+    with atomic_open(path) as f:
+        f.write(dumps_json(data))
+
+
+def write_output(path: str, updated_at: str, categories) -> None:
+    """Stream the output file one category at a time.
+    
+    categories yields (name, category_data) pairs, so only one category's
+    output dicts and serialized bytes exist at a time; the fetched price
+    series themselves stay in memory for the whole write.
+    """
+    with atomic_open(path) as f:
+        f.write(b'{"updated_at":' + dumps_json(updated_at) + b',"categories":{')
+        for i, (name, category_data) in enumerate(categories):
+            if i:
+                f.write(b",")
+            f.write(dumps_json(name) + b":" + dumps_json(category_data))
+        f.write(b"}}\n")
+
+
+# Concurrent per-ticker yfinance fallbacks
+STOCK_WORKERS = 8
+
+COINGECKO_HOST = "api.coingecko.com"
+
+# Optional CoinGecko demo API key (keyless requests also work)
+COINGECKO_API_KEY = os.environ.get("COINGECKO_API_KEY", "")
+
+# CoinGecko's keyless API allows ~5 calls/min (a demo key ~30/min).
+# RATE_LIMITER spaces the actual requests; the concurrency cap only bounds
+# how many coin fetches (cache lookups, retries) are in flight at once
+COINGECKO_CONCURRENCY = 5
+COINGECKO_INTERVAL = 2 if COINGECKO_API_KEY else 12  # seconds between coin requests
+
+# Exponential backoff for failed coin requests: 0.5s, 1s, 2s, ... capped
+COINGECKO_MAX_RETRIES = 6
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_CAP = 60  # seconds
+
+# On-disk price cache. Past daily bars never expire; CACHE_TTL only bounds
+# how stale the newest (still moving) bar may get. Entries younger than that
+# are served as-is, older ones refetch just the last few days and merge them
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "..", ".cache")
+CACHE_TTL = 15 * 60  # seconds
+CACHE_TAIL_DAYS = 3  # overlap when refetching the tail of a cached series
+CACHE_TOLERANCE = 0.01  # max relative drift on overlapping days before a full refetch
+CACHE_MAX_AGE_DAYS = 7  # drop a series whose fetch failed and whose last point is older
+
+# Published output; also seeds incremental fetches when the cache is empty
+OUTPUT_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "treasury_data.json")
+
+
+# date.toordinal() of 1970-01-01, for converting epoch timestamps to day numbers
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def today_ordinal() -> int:
+    """Day number of today in UTC, the calendar CoinGecko points are stamped in"""
+    return int(time.time() // 86_400) + EPOCH_ORDINAL
+
+
+# Every series loaded from disk repeats the same few hundred dates
+@functools.lru_cache(maxsize=4096)
+def date_ordinal(iso_date: str) -> int:
+    """date.toordinal() of an ISO date string"""
+    return date.fromisoformat(iso_date).toordinal()
+
+
+@dataclass
+class PriceSeries:
+    """Date-sorted price history.
+    
+    ordinals holds date.toordinal() day numbers parallel to the ISO date
+    strings, so period lookups compare integers instead of parsing dates.
+    Only dates and prices are written out (see to_columns).
+    """
+    dates: list = field(default_factory=list)
+    prices: list = field(default_factory=list)
+    ordinals: list = field(default_factory=list)
+    
+    def __len__(self) -> int:
+        return len(self.dates)
+    
+    @classmethod
+    def from_records(cls, records: list) -> "PriceSeries":
+        """Build from the older [{date, price}] layout"""
+        return cls.from_columns({
+            "dates": [p["date"] for p in records],
+            "prices": [p["price"] for p in records]
+        })
+    
+    @classmethod
+    def from_columns(cls, columns: dict) -> "PriceSeries":
+        """Build from the published {dates, prices} layout"""
+        dates = [str(d) for d in columns["dates"]]
+        prices = [float(p) for p in columns["prices"]]
+        if len(dates) != len(prices):
+            raise ValueError("dates and prices differ in length")
+        return cls(dates, prices, [date_ordinal(d) for d in dates])
+    
+    @classmethod
+    def from_json(cls, data) -> "PriceSeries":
+        """Build from either published layout"""
+        return cls.from_records(data) if isinstance(data, list) else cls.from_columns(data)
+    
+    def to_columns(self) -> dict:
+        """Project to the published {dates, prices} layout"""
+        return {"dates": self.dates, "prices": self.prices}
+
+
+class FileCache:
+    """JSON file cache stored as {root}/{source}/{md5(key)}.json"""
+    
+    def __init__(self, root: str):
+        self.root = root
+    
+    def _path(self, source: str, key: tuple) -> str:
+        digest = hashlib.md5(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.root, source, f"{digest}.json")
+    
+    def get(self, source: str, key: tuple):
+        """Return the cached {fetched_at, data} entry, or None"""
+        try:
+            return read_json(self._path(source, key))
+        except (OSError, ValueError):
+            return None
+    
+    def set(self, source: str, key: tuple, data) -> None:
+        path = self._path(source, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_json(path, {"fetched_at": time.time(), "data": data})
+
+
+CACHE = FileCache(CACHE_DIR)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter for the given 0-based attempt"""
+    return min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt) + random.uniform(0, BACKOFF_BASE)
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failed request may succeed later (5xx, dropped connection, timeout)"""
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class RateLimiter:
+    """Spaces out requests per host, sleeping only when they come too fast"""
+    
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._next_allowed = {}
+        self._lock = threading.Lock()
+    
+    def wait(self, host: str) -> None:
+        """Block until a request to host is allowed and reserve that slot"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_allowed.get(host, now))
+            self._next_allowed[host] = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+    
+    def backoff(self, host: str, seconds: float) -> None:
+        """Hold off the next request to host for at least `seconds`"""
+        with self._lock:
+            resume = time.monotonic() + seconds
+            self._next_allowed[host] = max(self._next_allowed.get(host, resume), resume)
+
+
+RATE_LIMITER = RateLimiter(COINGECKO_INTERVAL)
+
+# Price series from the previous run's output, keyed by (source, id)
+PREVIOUS_PRICES = {}
+
+# Shared HTTP session: keeps CoinGecko connections alive between calls and
+# retries transient failures. raise_on_status=False hands a persistent 429
+# back to get_crypto_data's own rate-limit handling.
+SESSION = requests.Session()
+# No adapter-level retries: get_crypto_data retries 429s, 5xx and
+# connection errors itself, so every attempt goes through RATE_LIMITER
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+SESSION.headers.update({"User-Agent": "crypto-treasury/1.0"})
+if COINGECKO_API_KEY:
+    SESSION.headers["x-cg-demo-api-key"] = COINGECKO_API_KEY
+
+
+def merge_prices(old: PriceSeries, new: PriceSeries, days: int) -> PriceSeries:
+    """Merge a freshly fetched tail into cached prices, trimmed to the window"""
+    cutoff = today_ordinal() - days
+    merged = {o: (d, p) for d, p, o in zip(old.dates, old.prices, old.ordinals)}
+    merged.update((o, (d, p)) for d, p, o in zip(new.dates, new.prices, new.ordinals))
+    
+    # A refetch can fill a gap or reach further back than the cache did
+    result = PriceSeries()
+    for o, (d, p) in sorted(merged.items()):
+        if o >= cutoff:
+            result.dates.append(d)
+            result.prices.append(p)
+            result.ordinals.append(o)
+    return result
+
+
+def tail_matches(old: PriceSeries, new: PriceSeries) -> bool:
+    """Check that a refetched tail agrees with the cached prices it overlaps"""
+    new_prices = dict(zip(new.ordinals, new.prices))
+    
+    # The newest cached point may be an intraday price, so it is skipped;
+    # any other drift means history was restated (e.g. a stock split)
+    tail = slice(-2 * CACHE_TAIL_DAYS, -1)
+    for o, old_price in zip(old.ordinals[tail], old.prices[tail]):
+        price = new_prices.get(o)
+        if price is not None and abs(price - old_price) > CACHE_TOLERANCE * abs(old_price):
+            return False
+    return True
+
+
+def load_previous_prices(path: str) -> dict:
+    """Index the price series in a previous output file by (source, id)"""
+    try:
+        previous = read_json(path)
+        
+        prices = {}
+        for category in previous["categories"].values():
+            prices[("coingecko", category["coin_id"])] = \
+                PriceSeries.from_json(category["coin_prices"])
+            for company in category["companies"]:
+                prices[("yfinance", company["ticker"])] = \
+                    PriceSeries.from_json(company["prices"])
+        return prices
+    except OSError:
+        return {}
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        logger.warning("Ignoring previous output (%r), doing a full fetch", e)
+        return {}
+
+
+def cache_lookup(source: str, name: str, days: int) -> tuple:
+    """Return (fresh prices or None, stale cached prices, days to fetch)"""
+    entry = CACHE.get(source, (name, days))
+    if entry:
+        try:
+            cached_prices = PriceSeries.from_json(entry["data"])
+        except (KeyError, TypeError, ValueError):
+            entry, cached_prices = None, PriceSeries()
+        if entry and time.time() - entry["fetched_at"] < CACHE_TTL:
+            return cached_prices, cached_prices, 0
+    
+    # Extend a stale cache entry, or else the last published series
+    if not entry:
+        cached_prices = PREVIOUS_PRICES.get((source, name), PriceSeries())
+    if not cached_prices:
+        return None, PriceSeries(), days
+    
+    fetch_days = today_ordinal() - cached_prices.ordinals[-1] + CACHE_TAIL_DAYS
+    return None, cached_prices, min(days, fetch_days)
+
+
+def cache_store(source: str, name: str, days: int,
+                cached_prices: PriceSeries, prices: PriceSeries):
+    """Merge fetched prices into the cache; keep recent stale data if the fetch failed.
+    
+    Returns None when the fetched tail contradicts the cached history, in
+    which case the caller should refetch the full window.
+    """
+    if not prices:
+        # A delisted ticker or rejected coin must not republish old history
+        # (seeded from the previous output) with "current" performance
+        prices = merge_prices(cached_prices, PriceSeries(), days)
+        if prices and today_ordinal() - prices.ordinals[-1] > CACHE_MAX_AGE_DAYS:
+            return PriceSeries()
+        return prices
+    if not tail_matches(cached_prices, prices):
+        return None
+    
+    prices = merge_prices(cached_prices, prices, days)
+    CACHE.set(source, (name, days), prices.to_columns())
+    return prices
+
+
+def cached(source: str):
+    """Serve a fetch function from CACHE, refetching only the missing tail"""
+    def decorator(fetch):
+        default_days = inspect.signature(fetch).parameters["days"].default
+        
+        @functools.wraps(fetch)
+        def wrapper(name: str, *args, days: int = default_days):
+            fresh, cached_prices, fetch_days = cache_lookup(source, name, days)
+            if fresh is not None:
+                return fresh
+            
+            prices = fetch(name, *args, days=fetch_days)
+            merged = cache_store(source, name, days, cached_prices, prices)
+            if merged is None:
+                logger.info("%s: history changed upstream, refetching %d days", name, days)
+                merged = cache_store(
+                    source, name, days, PriceSeries(), fetch(name, *args, days=days)
+                )
+            return merged
+        
+        return wrapper
+    return decorator
+
+
+def closes_to_prices(closes) -> PriceSeries:
+    """Convert a pandas Close series into a PriceSeries"""
+    closes = closes.dropna()
+    index = closes.index
+    if index.tz is not None:
+        index = index.tz_localize(None)  # keep the exchange's local dates
+    
+    days = index.values.astype("datetime64[D]")
+    return PriceSeries(
+        np.datetime_as_string(days).tolist(),
+        closes.round(2).tolist(),
+        (days.astype(np.int64) + EPOCH_ORDINAL).tolist()
+    )
+
+
+@cached("yfinance")
+def get_stock_data(ticker: str, days: int = 400) -> PriceSeries:
     """Fetch stock price data using yfinance"""
     try:
-        stock = yf.Ticker(ticker)
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
         
-        df = stock.history(start=start_date, end=end_date)
+        # yf.download skips the metadata request Ticker.history() makes
+        df = yf.download(
+            ticker, start=start_date, end=end_date, group_by="ticker",
+            threads=False, progress=False, auto_adjust=True
+        )
         
         if df.empty:
-            print(f"  Warning: No data for {ticker}")
-            return []
+            logger.warning("No data for %s", ticker)
+            return PriceSeries()
         
-        prices = []
-        for date, row in df.iterrows():
-            prices.append({
-                "date": date.strftime("%Y-%m-%d"),
-                "price": round(row["Close"], 2)
-            })
+        # Newer yfinance versions keep the ticker level even for one ticker
+        if df.columns.nlevels > 1:
+            return extract_prices(df, ticker)
+        return closes_to_prices(df["Close"])
+    except Exception as e:
+        logger.error("Error fetching %s: %s", ticker, e)
+        return PriceSeries()
+
+
+def extract_prices(df, ticker: str) -> PriceSeries:
+    """Pull one ticker's closing prices out of a batched yf.download frame"""
+    return closes_to_prices(df[ticker]["Close"])
+
+
+def download_stock_prices(tickers: list, days: int = 400) -> dict:
+    """Fetch prices for many tickers in a single batched yfinance request"""
+    try:
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days)
         
-        return prices
+        # Same adjustment as get_stock_data, so prices don't shift between
+        # batched and per-ticker fetches
+        df = yf.download(
+            tickers, start=start_date, end=end_date, group_by="ticker",
+            threads=True, progress=False, auto_adjust=True
+        )
     except Exception as e:
-        print(f"  Error fetching {ticker}: {e}")
-        return []
+        logger.error("Error in batch download: %s", e)
+        return {}
+    
+    available = set(df.columns.get_level_values(0))
+    return {
+        ticker: extract_prices(df, ticker)
+        for ticker in tickers if ticker in available
+    }
 
 
-def get_crypto_data(coin_id: str, symbol: str, days: int = 365) -> list:
-    """Fetch crypto price data using CoinGecko (no API key)"""
+def get_all_stock_data(tickers: list, days: int = 400) -> dict:
+    """Fetch prices for all tickers, falling back to per-ticker requests"""
+    prices = {}
+    stale = {}  # fetch window in days -> {ticker: cached prices}
+    
+    for ticker in tickers:
+        fresh, cached_prices, fetch_days = cache_lookup("yfinance", ticker, days)
+        if fresh is not None:
+            prices[ticker] = fresh
+        else:
+            stale.setdefault(fetch_days, {})[ticker] = cached_prices
     
-    print(f"  Fetching {coin_id} prices from CoinGecko...")
+    # One batch per window, so a cold ticker doesn't widen every tail refresh
+    for fetch_days, group in stale.items():
+        logger.info("Downloading %d tickers (%d days) from yfinance (%d cached)",
+                    len(group), fetch_days, len(prices))
+        batch = download_stock_prices(list(group), days=fetch_days)
+        for ticker, cached_prices in group.items():
+            if batch.get(ticker):
+                merged = cache_store(
+                    "yfinance", ticker, days, cached_prices, batch[ticker]
+                )
+                # Restated history is left to the per-ticker full refetch
+                if merged is not None:
+                    prices[ticker] = merged
     
-    url = f"https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart"
+    missing = [t for t in tickers if not prices.get(t)]
+    if missing:
+        logger.info("Retrying individually: %s", ", ".join(missing))
+        with ThreadPoolExecutor(max_workers=STOCK_WORKERS) as executor:
+            prices.update(zip(missing, executor.map(get_stock_data, missing)))
     
+    return prices
+
+
+def round_prices(values: np.ndarray) -> np.ndarray:
+    """Round coin prices, keeping more decimals for low-priced coins (e.g. BONK)"""
+    return np.where(
+        values < 0.01, np.round(values, 8),
+        np.where(values < 1, np.round(values, 6), np.round(values, 2))
+    )
+
+
+@cached("coingecko")
+def get_crypto_data(coin_id: str, symbol: str, days: int = 365) -> PriceSeries:
+    """Fetch crypto price data using CoinGecko"""
+    
+    logger.info("Fetching %s prices from CoinGecko", coin_id)
+    
+    url = f"https://{COINGECKO_HOST}/api/v3/coins/{coin_id}/market_chart/range"
+    
+    # Start at 00:00 UTC so the first day's first point is its daily price.
+    # Keyless and demo keys reject ranges older than 365 days, so the window
+    # covers today plus days - 1 whole past days
+    now = int(time.time())
     params = {
         'vs_currency': 'usd',
-        'days': days,
-        'interval': 'daily'
+        'from': (now // 86_400 - days + 1) * 86_400,
+        'to': now
     }
     
-    # Retry up to 3 times with increasing delay
-    for attempt in range(3):
+    for attempt in range(COINGECKO_MAX_RETRIES):
         try:
-            response = requests.get(url, params=params, timeout=30)
+            RATE_LIMITER.wait(COINGECKO_HOST)
+            response = SESSION.get(url, params=params, timeout=30)
             
             if response.status_code == 429:
-                wait_time = 30 * (attempt + 1)
-                print(f"    Rate limited. Waiting {wait_time}s...")
-                time.sleep(wait_time)
+                retry_after = response.headers.get("Retry-After", "")
+                wait_time = int(retry_after) if retry_after.isdigit() else backoff_delay(attempt)
+                logger.warning("%s: rate limited, waiting %.1fs", coin_id, wait_time)
+                RATE_LIMITER.backoff(COINGECKO_HOST, wait_time)
                 continue
             
             response.raise_for_status()
-            data = response.json()
+            data = loads_json(response.content)
             
-            prices = []
-            for item in data['prices']:
-                timestamp = item[0] / 1000
-                date = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d')
-                price = item[1]
-                
-                if price < 0.01:
-                    prices.append({"date": date, "price": round(price, 8)})
-                elif price < 1:
-                    prices.append({"date": date, "price": round(price, 6)})
-                else:
-                    prices.append({"date": date, "price": round(price, 2)})
+            raw = np.array(data['prices'], dtype=np.float64).reshape(-1, 2)
             
-            # Remove duplicates
-            seen = {}
-            for p in prices:
-                seen[p["date"]] = p
-            prices = list(seen.values())
-            prices.sort(key=lambda x: x["date"])
+            # Timestamps are UTC; a day's first point is its 00:00 price
+            point_days = raw[:, 0].astype(np.int64).astype("datetime64[ms]").astype("datetime64[D]")
+            ordinals = point_days.astype(np.int64) + EPOCH_ORDINAL
+            rounded = round_prices(raw[:, 1])
             
-            return prices
+            # The range endpoint picks its own granularity (hourly for
+            # windows under 90 days, as in cache tail fetches, daily
+            # beyond), so still reduce to one point per day: the first
+            # point of each past day, and the latest (live) point of today
+            keep = np.diff(ordinals, prepend=ordinals[:1] - 1) != 0
+            if keep.any():
+                keep[np.flatnonzero(keep)[-1]] = False
+                keep[-1] = True
+            return PriceSeries(
+                np.datetime_as_string(point_days[keep]).tolist(),
+                rounded[keep].tolist(),
+                ordinals[keep].tolist()
+            )
             
         except Exception as e:
-            print(f"    Attempt {attempt + 1}/3 failed: {e}")
-            if attempt < 2:
-                time.sleep(15)
+            # Retrying a rejected request (bad id, key or range) or a
+            # malformed payload would only hold up the other coins
+            if not is_retryable(e):
+                logger.warning("%s: giving up: %s", coin_id, e)
+                return PriceSeries()
+            logger.warning("%s: attempt %d/%d failed: %s",
+                           coin_id, attempt + 1, COINGECKO_MAX_RETRIES, e)
+            RATE_LIMITER.backoff(COINGECKO_HOST, backoff_delay(attempt))
     
-    return []
+    return PriceSeries()
 
 
-def calculate_performance(prices: list) -> dict:
-    """Calculate performance for different periods"""
-    if not prices or len(prices) < 2:
-        return {"1W": None, "3M": None, "6M": None, "YTD": None, "1Y": None}
+# Lookback periods in days (YTD is handled separately)
+PERIODS = {
+    "1W": 7,
+    "3M": 90,
+    "6M": 180,
+    "1Y": 365
+}
+
+
+def _perf(ordinals, pxs, target_ords):
+    """Percent change vs the price closest to each target day (NaN if unusable)"""
+    idx = np.searchsorted(ordinals, target_ords)
+    after = np.minimum(idx, len(ordinals) - 1)
+    before = np.maximum(idx - 1, 0)
     
-    current_price = prices[-1]["price"]
-    current_date = datetime.strptime(prices[-1]["date"], "%Y-%m-%d")
+    # Take the earlier neighbour when it is at least as close
+    use_before = target_ords - ordinals[before] <= ordinals[after] - target_ords
+    refs = pxs[np.where(use_before, before, after)]
     
-    periods = {
-        "1W": 7,
-        "3M": 90,
-        "6M": 180,
-        "1Y": 365
-    }
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(refs > 0, (pxs[-1] - refs) / refs * 100.0, np.nan)
+
+
+def calculate_performance(prices: PriceSeries) -> dict:
+    """Calculate performance for different periods"""
+    if len(prices) < 2:
+        return {"1W": None, "3M": None, "6M": None, "YTD": None, "1Y": None}
     
-    performance = {}
+    ordinals = np.asarray(prices.ordinals, dtype=np.int64)
+    pxs = np.asarray(prices.prices, dtype=np.float64)
+    current_ord = prices.ordinals[-1]
     
-    for period_name, days in periods.items():
-        target_date = current_date - timedelta(days=days)
-        
-        # Find closest price to target date
-        closest_price = None
-        min_diff = float('inf')
-        
-        for p in prices:
-            p_date = datetime.strptime(p["date"], "%Y-%m-%d")
-            diff = abs((p_date - target_date).days)
-            if diff < min_diff and p_date <= current_date:
-                min_diff = diff
-                closest_price = p["price"]
-        
-        if closest_price and closest_price > 0:
-            perf = ((current_price - closest_price) / closest_price) * 100
-            performance[period_name] = round(perf, 2)
-        else:
-            performance[period_name] = None
+    target_ords = current_ord - np.array(list(PERIODS.values()), dtype=np.int64)
+    perfs = _perf(ordinals, pxs, target_ords)
     
-    # Calculate YTD (Year-to-Date)
-    ytd_start = datetime(current_date.year, 1, 1)
-    ytd_price = None
-    min_diff = float('inf')
+    performance = {
+        period_name: None if np.isnan(perf) else round(float(perf), 2)
+        for period_name, perf in zip(PERIODS, perfs)
+    }
     
-    for p in prices:
-        p_date = datetime.strptime(p["date"], "%Y-%m-%d")
-        diff = abs((p_date - ytd_start).days)
-        if diff < min_diff and p_date >= ytd_start:
-            min_diff = diff
-            ytd_price = p["price"]
+    # Calculate YTD (Year-to-Date) from the first price of the year
+    ytd_ord = date(date.fromordinal(current_ord).year, 1, 1).toordinal()
+    ytd_idx = int(np.searchsorted(ordinals, ytd_ord))
+    ytd_price = prices.prices[ytd_idx] if ytd_idx < len(prices) else None
     
     if ytd_price and ytd_price > 0:
-        ytd_perf = ((current_price - ytd_price) / ytd_price) * 100
+        ytd_perf = ((prices.prices[-1] - ytd_price) / ytd_price) * 100
         performance["YTD"] = round(ytd_perf, 2)
     else:
         performance["YTD"] = None
@@ -257,75 +713,117 @@ def calculate_performance(prices: list) -> dict:
     return performance
 
 
-def main():
-    print("=" * 60)
-    print("Crypto Treasury Companies Data Updater")
-    print("Using: yfinance (stocks) + CoinGecko (crypto)")
-    print("Note: CoinGecko free API has rate limits (~5 calls/min)")
-    print("      This will take about 2-3 minutes to complete.")
-    print("=" * 60)
-    
-    output_data = {
-        "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M"),
-        "categories": {}
-    }
+# In-flight coin fetches keyed by (source, id); duplicate requests for the
+# same coin await the running task instead of issuing another HTTP call
+_inflight = {}
+
+
+async def _fetch_crypto(config: dict, limit: asyncio.Semaphore) -> PriceSeries:
+    """Fetch one coin's prices without blocking the event loop"""
+    async with limit:
+        return await asyncio.to_thread(
+            get_crypto_data, config["coin_id"], config["coin_symbol"]
+        )
+
+
+def fetch_crypto(config: dict, limit: asyncio.Semaphore) -> asyncio.Future:
+    """Return the in-flight fetch for this coin, starting one if needed"""
+    key = ("coingecko", config["coin_id"])
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_crypto(config, limit))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return task
+
+
+async def fetch_all(tickers: list) -> tuple:
+    """Fetch every coin and stock history concurrently"""
+    limit = asyncio.Semaphore(COINGECKO_CONCURRENCY)
+    coin_tasks = [
+        fetch_crypto(config, limit) for config in TREASURY_COMPANIES.values()
+    ]
+    stock_task = asyncio.to_thread(get_all_stock_data, tickers)
     
+    # A failed task must not take the other results down with it
+    *coin_results, stock_prices = await asyncio.gather(
+        *coin_tasks, stock_task, return_exceptions=True
+    )
+    
+    coin_prices = {}
+    for category, result in zip(TREASURY_COMPANIES, coin_results):
+        if isinstance(result, Exception):
+            logger.error("[%s] coin fetch failed: %r", category, result)
+            result = PriceSeries()
+        coin_prices[category] = result
+    
+    if isinstance(stock_prices, Exception):
+        logger.error("Stock fetch failed: %r", stock_prices)
+        stock_prices = {}
+    
+    return coin_prices, stock_prices
+
+
+def build_categories(coin_prices: dict, all_stock_prices: dict):
+    """Yield (category, category_data) for the output file in config order"""
     for category, config in TREASURY_COMPANIES.items():
-        print(f"\n[{category}] Processing...")
         
         category_data = {
             "coin_id": config["coin_id"],
             "coin_symbol": config["coin_symbol"],
             "coin_color": config["color"],
-            "coin_prices": [],
-            "coin_performance": {},
+            "coin_prices": coin_prices[category].to_columns(),
+            "coin_performance": calculate_performance(coin_prices[category]),
             "companies": []
         }
         
-        # Fetch crypto data
-        coin_prices = get_crypto_data(config["coin_id"], config["coin_symbol"])
-        category_data["coin_prices"] = coin_prices
-        category_data["coin_performance"] = calculate_performance(coin_prices)
-        print(f"    -> {len(coin_prices)} data points")
-        
-        print("    (waiting 12s for rate limit...)")
-        time.sleep(12)  # CoinGecko free API: ~5 calls/min
-        
-        # Fetch stock data for each company
-        for i, company in enumerate(config["companies"]):
-            ticker = company["ticker"]
-            name = company["name"]
-            
-            print(f"  Fetching {ticker} ({name})...")
-            stock_prices = get_stock_data(ticker)
-            
+        for company, color in zip(config["companies"], itertools.cycle(STOCK_COLORS)):
+            stock_prices = all_stock_prices.get(company["ticker"], PriceSeries())
             company_data = {
-                "ticker": ticker,
-                "name": name,
-                "color": STOCK_COLORS[i % len(STOCK_COLORS)],
-                "prices": stock_prices,
+                "ticker": company["ticker"],
+                "name": company["name"],
+                "color": color,
+                "prices": stock_prices.to_columns(),
                 "performance": calculate_performance(stock_prices)
             }
             
             category_data["companies"].append(company_data)
-            print(f"    -> {len(stock_prices)} data points")
-            
-            time.sleep(0.5)  # Rate limiting
         
-        output_data["categories"][category] = category_data
+        # One summary line per category: coin and stock data point counts
+        logger.info("[%s] %s %d | %s", category, config["coin_symbol"],
+                    len(coin_prices[category]),
+                    ", ".join(f"{c['ticker']} {len(c['prices']['dates'])}"
+                              for c in category_data["companies"]))
+        yield category, category_data
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    
+    logger.info("Crypto Treasury Companies Data Updater")
+    logger.info("Using: yfinance (stocks) + CoinGecko (crypto)")
+    if COINGECKO_API_KEY:
+        logger.info("Note: using CoinGecko demo API key (~30 calls/min)")
+    else:
+        logger.info("Note: CoinGecko free API has rate limits (~5 calls/min)")
+    
+    PREVIOUS_PRICES.update(load_previous_prices(OUTPUT_PATH))
+    
+    updated_at = datetime.now().strftime("%Y-%m-%d %H:%M")
+    
+    all_tickers = [
+        company["ticker"]
+        for config in TREASURY_COMPANIES.values()
+        for company in config["companies"]
+    ]
     
-    # Save to JSON
-    output_dir = os.path.join(os.path.dirname(__file__), "..", "data")
-    os.makedirs(output_dir, exist_ok=True)
+    coin_prices, all_stock_prices = asyncio.run(fetch_all(all_tickers))
     
-    output_path = os.path.join(output_dir, "treasury_data.json")
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(output_data, f, ensure_ascii=False)
+    # Save to JSON, serializing each category as soon as it is built
+    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
+    write_output(OUTPUT_PATH, updated_at, build_categories(coin_prices, all_stock_prices))
     
-    print(f"\n{'=' * 60}")
-    print(f"Data saved to {output_path}")
-    print(f"Updated at: {output_data['updated_at']}")
-    print("=" * 60)
+    logger.info("Data saved to %s (updated at %s)", OUTPUT_PATH, updated_at)
 
 
 if __name__ == "__main__":